@@ -1,17 +1,37 @@
 import argparse
+import calendar
 import os
 import csv
-import requests
+import operator
+import re
+import shutil
 import json
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Global variables
-activity_json_filename = 'activity-{}.json'.format(datetime.now().strftime("%Y%m%d"))
-activity_namespaces_filename = 'activity-namespaces-{}.csv'.format(datetime.now().strftime("%Y%m%d"))
-activity_mounts_filename = 'activity-mounts-{}.csv'.format(datetime.now().strftime("%Y%m%d"))
+date_str = datetime.now().strftime("%Y%m%d")
+activity_json_filename = 'activity-{}.json'.format(date_str)
+activity_namespaces_filename = 'activity-namespaces-{}.csv'.format(date_str)
+activity_mounts_filename = 'activity-mounts-{}.csv'.format(date_str)
 billing_start_date = "2023-06-01"
+date_pattern = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}')
 vault_addr = os.environ.get('VAULT_ADDR')
 vault_token = os.environ.get('VAULT_TOKEN')
+vault_session = None
+# Activity JSON files larger than this are parsed incrementally with ijson
+streaming_threshold_bytes = 64 * 1024 * 1024
+streamed_activity_keys = ('start_time', 'total', 'by_namespace')
+client_counts = operator.itemgetter('clients', 'entity_clients', 'non_entity_clients')
 
 
 def _get_first_day_of_month(month):
@@ -39,8 +59,7 @@ def _get_last_day_of_month(month):
     Returns:
         datetime: A datetime object representing the last day of the input month.
     """
-    next_month = month.replace(day=28) + timedelta(days=4)
-    return next_month - timedelta(days=next_month.day)
+    return month.replace(day=calendar.monthrange(month.year, month.month)[1])
 
 
 def _get_last_month():
@@ -54,10 +73,190 @@ def _get_last_month():
     return (datetime.today().replace(day=1) - timedelta(days=1))  #.strftime('%Y-%m')
 
 
-# Create activity report
-import requests
+def _validate_date(value):
+    """
+    This function checks that a command line date argument is a valid date in the format 'YYYY-MM-DD'.
+    The format is checked with a precompiled regex before the date values are validated.
+
+    Args:
+        value (str): The date string to validate.
+
+    Returns:
+        str: The validated date string.
+
+    Raises:
+        argparse.ArgumentTypeError: If the date string is not in the format 'YYYY-MM-DD' or is not a real date.
+    """
+    if not date_pattern.fullmatch(value):
+        raise argparse.ArgumentTypeError(f"invalid date '{value}', expected format YYYY-MM-DD")
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}', not a valid calendar date")
+    return value
+
+
+def _json_loads(content):
+    """
+    This function parses a JSON document from bytes, using orjson when it is installed and falling back to the stdlib json module.
+
+    Args:
+        content (bytes): The raw JSON document.
+
+    Returns:
+        The parsed JSON document.
+    """
+    if orjson:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _get_session():
+    """
+    This function returns the shared requests session used for Vault API calls, creating it on first use.
+    The session pools connections to Vault, retries transient failures and sends the Vault token on every request.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global vault_session
+    if vault_session is None:
+        # requests is only needed when fetching from Vault, so it is not imported for -f runs
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # Return the last error response once retries are exhausted, so its status and body can be reported
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries)
+        vault_session = requests.Session()
+        vault_session.mount('https://', adapter)
+        vault_session.mount('http://', adapter)
+        vault_session.headers['X-Vault-Token'] = vault_token
+    return vault_session
+
+
+def _stream_activity_data(json_file):
+    """
+    This function incrementally parses a Vault activity API response with ijson, building only the 'data' keys used by the
+    report. Other keys, such as the per-month breakdown in 'months', are skipped without being materialized.
+
+    Args:
+        json_file (file): A binary file object containing the activity API response.
+
+    Returns:
+        dict: The 'start_time', 'total' and 'by_namespace' entries of the 'data' section, empty if none are present.
+
+    Raises:
+        KeyError: If the response has no top-level 'data' key.
+    """
+    data = {}
+    has_data = False
+    key = builder = None
+    for prefix, event, value in ijson.parse(json_file, use_float=True):
+        if prefix == '' and event == 'map_key' and value == 'data':
+            has_data = True
+        elif prefix == 'data' and event in ('map_key', 'end_map'):
+            if builder is not None:
+                data[key] = builder.value
+            key = value
+            builder = ijson.ObjectBuilder() if key in streamed_activity_keys else None
+        elif builder is not None:
+            builder.event(event, value)
+
+    if not has_data:
+        raise KeyError('data')
+    return data
+
+
+# Load activity report
+def load_activity_data(json_file_name):
+    """
+    This function loads the activity report data from a JSON file containing a Vault activity API response.
+    Files larger than 'streaming_threshold_bytes' are parsed incrementally when ijson is installed.
+
+    Args:
+        json_file_name (str): The name of the JSON file to load.
+
+    Returns:
+        dict: The 'data' section of the activity API response.
+    """
+    with open(json_file_name, "rb") as json_file:
+        if ijson and os.path.getsize(json_file_name) > streaming_threshold_bytes:
+            return _stream_activity_data(json_file)
+        return _json_loads(json_file.read())["data"]
 
 
+# Process activity report
+def process_activity_data(data):
+    """
+    This function flattens the activity report data into namespace and mount rows ready to be written to CSV.
+    The first row of each list is the CSV header.
+
+    Args:
+        data (dict): The activity report data containing a 'by_namespace' list.
+
+    Returns:
+        tuple: A (namespaces, mounts) tuple of row lists.
+    """
+    by_namespace = data.get("by_namespace", [])
+
+    namespaces = [['namespace_id', 'namespace_path', 'mounts', 'clients', 'entity_clients', 'non_entity_clients']]
+    namespaces.extend([namespace["namespace_id"],
+                       namespace["namespace_path"],
+                       len(namespace["mounts"]),
+                       *client_counts(namespace["counts"])]
+                      for namespace in by_namespace)
+
+    mounts = [['namespace_id', 'namespace_path', 'mount_path', 'clients', 'entity_clients', 'non_entity_clients']]
+    mounts.extend([namespace["namespace_id"],
+                   namespace["namespace_path"],
+                   mount["mount_path"],
+                   *client_counts(mount["counts"])]
+                  for namespace in by_namespace for mount in namespace["mounts"])
+
+    return namespaces, mounts
+
+
+def _write_csv(filename, rows):
+    """
+    This function writes a list of rows to a CSV file.
+    The rows are joined into a single string and written in one call. If any value contains a comma, quote or line break,
+    or may be None, the csv module is used instead so that the output matches csv.writer.
+
+    Args:
+        filename (str): The name of the CSV file to write.
+        rows (list): The rows to write, including the header row.
+    """
+    content = ''.join([','.join(map(str, row)) + '\r\n' for row in rows])
+    # str(None) gives 'None' where csv.writer writes an empty field
+    needs_quoting = ('"' in content
+                     or 'None' in content
+                     or content.count(',') != sum(map(len, rows)) - len(rows)
+                     or content.count('\n') != len(rows)
+                     or content.count('\r') != len(rows))
+
+    with open(filename, 'w', newline='') as csvfile:
+        if needs_quoting:
+            csv.writer(csvfile).writerows(rows)
+        else:
+            csvfile.write(content)
+
+
+# Write activity report
+def write_csv_reports(namespaces, mounts):
+    """
+    This function writes the namespace and mount rows to the 'activity-namespaces-{}.csv' and 'activity-mounts-{}.csv' files.
+
+    Args:
+        namespaces (list): The namespace rows, including the header row.
+        mounts (list): The mount rows, including the header row.
+    """
+    _write_csv(activity_mounts_filename, mounts)
+    _write_csv(activity_namespaces_filename, namespaces)
+
+
+# Create activity report
 def create_activity_report(start_date=None, end_date=None, json_file_name=None):
     """
     This function creates an activity report based on the provided start and end dates, or from a provided JSON file.
@@ -67,90 +266,69 @@ def create_activity_report(start_date=None, end_date=None, json_file_name=None):
         start_date (str, optional): The start date for the activity report in the format 'YYYY-MM-DD'. Defaults to None.
         end_date (str, optional): The end date for the activity report in the format 'YYYY-MM-DD'. Defaults to None.
         json_file_name (str, optional): The name of a JSON file to use for creating the activity report. Defaults to None.
-    """
 
-    namespaces = [['namespace_id', 'namespace_path', 'mounts', 'clients', 'entity_clients', 'non_entity_clients']]
-    mounts = [['namespace_id', 'namespace_path', 'mount_path', 'clients', 'entity_clients', 'non_entity_clients']]
+    Returns:
+        tuple: A (namespaces, mounts) tuple of the rows written to the CSV files.
+    """
 
     # start_date = _get_first_day_of_month(datetime.strptime(month, '%Y-%m')).strftime("%Y-%m-%d")
     # end_date = _get_last_day_of_month(datetime.strptime(month, '%Y-%m')).strftime("%Y-%m-%d")
 
-    data = None
     if json_file_name:
         print(f"Fetching activity report from {json_file_name}")
-        with open(json_file_name, "r") as json_file:
-            data = json.load(json_file)["data"]
+        data = load_activity_data(json_file_name)
     else:
-        url = f"{vault_addr}/v1/sys/internal/counters/activity?end_time={end_date}T00%3A00%3A00Z&start_time={start_date}T00%3A00%3A00Z"
+        url = f"{vault_addr}/v1/sys/internal/counters/activity"
+        params = {'start_time': f"{start_date}T00:00:00Z", 'end_time': f"{end_date}T00:00:00Z"}
         print(f"Fetching activity report data for {start_date} to {end_date}\n{url}")
 
-        headers = {'X-Vault-Token': vault_token}
-        response = requests.get(url, headers=headers, timeout=300)
-        if response.status_code == 200:
-            data = response.json()["data"]
+        # Stream the response body straight to disk instead of holding it in memory
+        with _get_session().get(url, params=params, timeout=300, stream=True) as response:
+            if response.status_code != 200:
+                raise Exception(f"Error creating activity report {response.status_code} - {response.text}")
 
-            print(f"Summary - Start datetime: {data['start_time']}, clients:{data['total']['clients']}, entity_clients:{data['total']['entity_clients']}, "
-                  f"non_entity_clients:{data['total']['non_entity_clients']}\n")
+            response.raw.decode_content = True
+            with open(activity_json_filename, 'wb') as jsonfile:
+                shutil.copyfileobj(response.raw, jsonfile, 1024 * 1024)
 
-            with open(activity_json_filename, 'w') as jsonfile:
-                json.dump(data, jsonfile)
-        else:
-            raise Exception(f"Error creating activity report {response.status_code} - {response.text}")
+        data = load_activity_data(activity_json_filename)
 
-    if data:
-        for namespace in data["by_namespace"]:
-            namespaces.append([namespace["namespace_id"],
-                               namespace["namespace_path"],
-                               len(namespace["mounts"]),
-                               namespace["counts"]["clients"],
-                               namespace["counts"]["entity_clients"],
-                               namespace["counts"]["non_entity_clients"]])
+        print(f"Summary - Start datetime: {data['start_time']}, clients:{data['total']['clients']}, entity_clients:{data['total']['entity_clients']}, "
+              f"non_entity_clients:{data['total']['non_entity_clients']}\n")
 
-            for mount in namespace["mounts"]:
-                mounts.append([namespace["namespace_id"],
-                               namespace["namespace_path"],
-                               mount["mount_path"],
-                               mount["counts"]["clients"],
-                               mount["counts"]["entity_clients"],
-                               mount["counts"]["non_entity_clients"]])
+    namespaces, mounts = process_activity_data(data or {})
+    write_csv_reports(namespaces, mounts)
 
+    return namespaces, mounts
 
-    with open(activity_mounts_filename, 'w') as csvfile:
-        csvwriter = csv.writer(csvfile)
-        csvwriter.writerows(iter(mounts))
 
-    with open(activity_namespaces_filename, 'w') as csvfile:
-        csvwriter = csv.writer(csvfile)
-        csvwriter.writerows(iter(namespaces))
-
-
-# Read activity report
-def read_activity_report():
+# Print activity report
+def read_activity_report(namespaces, mounts):
     """
-    This function reads the activity report from two CSV files: 'activity-namespaces-{}.csv' and 'activity-mounts-{}.csv'.
-    It prints the contents of these files to the console. The first file contains information about namespaces and the second one about mounts.
+    This function prints the activity report namespace and mount rows to the console.
+    The rows are the ones returned by create_activity_report, so the CSV files are not read back from disk.
+
+    Args:
+        namespaces (list): The namespace rows, including the header row.
+        mounts (list): The mount rows, including the header row.
 
     Prints:
-        Namespace client counts: Prints the contents of the 'activity-namespaces-{}.csv' file.
-        Mount path client counts: Prints the contents of the 'activity-mounts-{}.csv' file.
+        Namespace client counts: The rows written to the 'activity-namespaces-{}.csv' file.
+        Mount path client counts: The rows written to the 'activity-mounts-{}.csv' file.
     """
     print("Namespace client counts")
-    with open(activity_namespaces_filename, newline='') as csvfile:
-        reader = csv.reader(csvfile)
-        for row in reader:
-            print(row)
+    for row in namespaces:
+        print(row)
 
     print("\nMount path client counts")
-    with open(activity_mounts_filename, newline='') as csvfile:
-        reader = csv.reader(csvfile)
-        for row in reader:
-            print(row)
+    for row in mounts:
+        print(row)
 
 
 def main():
     parser = argparse.ArgumentParser(description='Create vault client activity report.')
-    parser.add_argument('-s', '--start_date', type=str, help='Start date (YYYY-MM-DD) for the activity report')
-    parser.add_argument('-e', '--end_date', type=str, help='End date (YYYY-MM-DD) for the activity report')
+    parser.add_argument('-s', '--start_date', type=_validate_date, help='Start date (YYYY-MM-DD) for the activity report')
+    parser.add_argument('-e', '--end_date', type=_validate_date, help='End date (YYYY-MM-DD) for the activity report')
     parser.add_argument('-f', '--filename', type=str, help='JSON file name for the activity report')
     parser.add_argument('-p', '--print', default=False, action=argparse.BooleanOptionalAction,
                         help='Print the activity report')
@@ -171,7 +349,7 @@ def main():
         json_file_name = args.filename
 
     if json_file_name:
-        create_activity_report(json_file_name=json_file_name)
+        namespaces, mounts = create_activity_report(json_file_name=json_file_name)
     else:
         # Confirm if VAULT_ADDR and VAULT_TOKEN environment variables are set
         if not vault_token:
@@ -179,10 +357,10 @@ def main():
         if not vault_addr:
             raise Exception("VAULT_ADDR environment variable not set")
 
-        create_activity_report(start_date=start_date, end_date=end_date)
+        namespaces, mounts = create_activity_report(start_date=start_date, end_date=end_date)
 
     if args.print:
-        read_activity_report()
+        read_activity_report(namespaces, mounts)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,15 @@
-import os
-import sys
+import argparse
+import csv
+import threading
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-sys.path.insert(0, f"{os.path.dirname(__file__)}/../")
+import pytest
+from urllib3.util.retry import Retry
 
-from main import _get_first_day_of_month, _get_last_day_of_month, _get_last_month
+from activity_export.main import _get_first_day_of_month, _get_last_day_of_month, _get_last_month, _get_session, \
+    _stream_activity_data, _validate_date, _write_csv, create_activity_report, load_activity_data, \
+    process_activity_data
 
 
 def test_get_first_day_of_month():
@@ -31,5 +36,153 @@ def test_get_last_day_of_month_3():
     assert _get_last_day_of_month(month) == expected
 
 
-def test_get_last_month():
-    assert _get_last_month() == '2024-03'
+def test_get_last_day_of_month_4():
+    month = datetime(2024, 2, 15)
+    expected = datetime(2024, 2, 29, 0, 0, 0)
+    assert _get_last_day_of_month(month) == expected
+
+
+@pytest.mark.parametrize("today, expected", [
+    (datetime(2024, 4, 15), datetime(2024, 3, 31)),
+    (datetime(2024, 1, 10), datetime(2023, 12, 31)),
+    (datetime(2024, 3, 1), datetime(2024, 2, 29)),
+    (datetime(2023, 3, 31), datetime(2023, 2, 28)),
+])
+def test_get_last_month(monkeypatch, today, expected):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def today(cls):
+            return today
+
+    monkeypatch.setattr("activity_export.main.datetime", FrozenDatetime)
+    assert _get_last_month() == expected
+
+
+def test_load_activity_data(tmp_path):
+    filename = tmp_path / "activity.json"
+    filename.write_bytes(b'{"request_id": "1", "data": {"by_namespace": []}}')
+    assert load_activity_data(filename) == {"by_namespace": []}
+
+
+def test_process_activity_data():
+    data = {"by_namespace": [
+        {"namespace_id": "root", "namespace_path": "", "counts": {"clients": 3, "entity_clients": 2, "non_entity_clients": 1},
+         "mounts": [{"mount_path": "auth/userpass/", "counts": {"clients": 2, "entity_clients": 2, "non_entity_clients": 0}},
+                    {"mount_path": "auth/token/", "counts": {"clients": 1, "entity_clients": 0, "non_entity_clients": 1}}]},
+        {"namespace_id": "abc12", "namespace_path": "team-a/", "counts": {"clients": 0, "entity_clients": 0, "non_entity_clients": 0},
+         "mounts": []}]}
+    namespaces, mounts = process_activity_data(data)
+    assert namespaces[1:] == [['root', '', 2, 3, 2, 1], ['abc12', 'team-a/', 0, 0, 0, 0]]
+    assert mounts[1:] == [['root', '', 'auth/userpass/', 2, 2, 0], ['root', '', 'auth/token/', 1, 0, 1]]
+
+
+def test_process_activity_data_empty():
+    namespaces, mounts = process_activity_data({})
+    assert len(namespaces) == 1
+    assert len(mounts) == 1
+
+
+@pytest.fixture
+def unavailable_vault(monkeypatch):
+    class UnavailableHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = b'{"errors":["Vault is sealed"]}'
+            self.send_response(503)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), UnavailableHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr("activity_export.main.vault_addr", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(Retry, "sleep", lambda self, response=None: None)
+    yield
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_session_is_shared(monkeypatch):
+    monkeypatch.setattr("activity_export.main.vault_session", None)
+    assert _get_session() is _get_session()
+
+
+def test_create_activity_report_error_response(monkeypatch, unavailable_vault):
+    monkeypatch.setattr("activity_export.main.vault_session", None)
+    with pytest.raises(Exception) as excinfo:
+        create_activity_report("2024-01-01", "2024-01-31")
+    assert str(excinfo.value) == 'Error creating activity report 503 - {"errors":["Vault is sealed"]}'
+
+
+def test_write_csv(tmp_path):
+    rows = [['namespace_id', 'namespace_path', 'clients'], ['root', '', 3], ['abc12', 'team-a/', 0]]
+    filename = tmp_path / "test.csv"
+    _write_csv(filename, rows)
+    assert filename.read_bytes() == b'namespace_id,namespace_path,clients\r\nroot,,3\r\nabc12,team-a/,0\r\n'
+
+
+def test_write_csv_quotes_special_characters(tmp_path):
+    rows = [['namespace_id', 'namespace_path', 'clients'], ['abc12', 'team,a/', 1], ['def34', 'team "b"/', 2]]
+    filename = tmp_path / "test.csv"
+    _write_csv(filename, rows)
+    with open(filename, newline='') as csvfile:
+        assert list(csv.reader(csvfile)) == [[str(value) for value in row] for row in rows]
+
+
+def test_write_csv_matches_csv_writer_for_none(tmp_path):
+    rows = [['namespace_id', 'clients'], [None, 1.5], ['None', 2]]
+    filename = tmp_path / "test.csv"
+    _write_csv(filename, rows)
+    assert filename.read_bytes() == b'namespace_id,clients\r\n,1.5\r\nNone,2\r\n'
+
+
+def test_stream_activity_data(tmp_path):
+    filename = tmp_path / "activity.json"
+    filename.write_bytes(b'{"request_id": "1", "data": {"by_namespace": [{"namespace_id": "root", "mounts": []}], '
+                         b'"months": [{"timestamp": "2024-01-01T00:00:00Z"}], "start_time": "2024-01-01T00:00:00Z", '
+                         b'"total": {"clients": 1, "entity_clients": 1, "non_entity_clients": 0}}}')
+    with open(filename, "rb") as json_file:
+        data = _stream_activity_data(json_file)
+    assert data == {"by_namespace": [{"namespace_id": "root", "mounts": []}],
+                    "start_time": "2024-01-01T00:00:00Z",
+                    "total": {"clients": 1, "entity_clients": 1, "non_entity_clients": 0}}
+
+
+@pytest.mark.parametrize("content, expected", [
+    (b'{"data": {"by_namespace": [], "months": [], "start_time": "2024-01-01T00:00:00Z"}}',
+     {"by_namespace": [], "start_time": "2024-01-01T00:00:00Z"}),
+    (b'{"data": {"months": []}}', {}),
+    (b'{"data": null}', {}),
+])
+def test_load_activity_data_streamed(monkeypatch, tmp_path, content, expected):
+    monkeypatch.setattr("activity_export.main.streaming_threshold_bytes", 0)
+    filename = tmp_path / "activity.json"
+    filename.write_bytes(content)
+    assert load_activity_data(filename) == expected
+
+
+def test_load_activity_data_streamed_missing_data(monkeypatch, tmp_path):
+    monkeypatch.setattr("activity_export.main.streaming_threshold_bytes", 0)
+    filename = tmp_path / "activity.json"
+    filename.write_bytes(b'{"errors": [], "other": {"data": {"total": {}}}}')
+    with pytest.raises(KeyError):
+        load_activity_data(filename)
+
+
+def test_validate_date():
+    assert _validate_date("2024-02-29") == "2024-02-29"
+
+
+@pytest.mark.parametrize("value", ["2024-1-01", "20240101", "2024-01-01T00:00:00", "\uff12\uff10\uff12\uff14-01-01"])
+def test_validate_date_invalid_format(value):
+    with pytest.raises(argparse.ArgumentTypeError, match="expected format YYYY-MM-DD"):
+        _validate_date(value)
+
+
+@pytest.mark.parametrize("value", ["2024-13-01", "2023-02-29", "2024-02-30"])
+def test_validate_date_invalid_day(value):
+    with pytest.raises(argparse.ArgumentTypeError, match="not a valid calendar date"):
+        _validate_date(value)
@@ -5,10 +5,17 @@ import logging
 import json
 import os
 import queue
+import requests
 import threading
 import time
-import summary
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 # Define Vault connection parameters from environment variables
@@ -25,6 +32,7 @@ else:
 
 # Define HVAC client parameters
 HVAC_TIMEOUT = 3
+HVAC_RETRIES = 3
 
 # Define number of worker threads
 WORKER_THREADS = 4
@@ -33,8 +41,76 @@ RATE_LIMIT_BATCH_SIZE = 100
 RATE_LIMIT_SLEEP_SECONDS = 3
 RATE_LIMIT_DISABLE = False
 
+# Namespace path to start the audit from, "" is the root namespace
+NAMESPACE_PATH = ""
+
 logger = logging.getLogger(__name__)
 
+# dictionaries to store outputs
+global_namespaces = {}
+global_auth_methods = {}
+global_secret_engines = {}
+
+# counter to rate limit requests
+global_counter = 0
+
+# counter to log errors
+global_error_counter = 0
+
+# thread lock for updating counters
+global_thread_lock = threading.Lock()
+
+# Per worker thread storage for reusing HTTP sessions and Vault clients across namespaces
+thread_local = threading.local()
+
+
+def get_session():
+    """
+    Returns the HTTP session for the current worker thread, creating it on first use.
+    Reusing the session keeps connections to Vault open across namespaces instead of
+    opening a new TCP and TLS connection for every namespace.
+    """
+    session = getattr(thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.verify = VAULT_TLS_VERIFY
+        # Retry connection and read errors, e.g. timeouts when the Vault FQDN DNS record changes.
+        # hvac lists namespaces with the LIST method, which urllib3 does not retry by default
+        retries = Retry(total=HVAC_RETRIES, backoff_factor=0.2,
+                        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"LIST"})
+        adapter = HTTPAdapter(max_retries=retries)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        thread_local.session = session
+    return session
+
+
+def get_vault_client(namespace_path: str):
+    """
+    Returns the Vault client for the current worker thread, targeted at the given namespace.
+    The client is created once per thread and its namespace is switched for each request.
+    Args:
+    namespace_path: Path of the namespace to send requests to.
+    """
+    vault_client = getattr(thread_local, "vault_client", None)
+    if vault_client is None:
+        vault_client = hvac.Client(url=VAULT_ADDR, token=VAULT_TOKEN, verify=VAULT_TLS_VERIFY,
+                                   timeout=HVAC_TIMEOUT, session=get_session())
+        thread_local.vault_client = vault_client
+    vault_client.adapter.namespace = namespace_path
+    return vault_client
+
+
+def close_session():
+    """
+    Closes the HTTP session of the current worker thread, releasing its pooled connections.
+    """
+    session = getattr(thread_local, "session", None)
+    if session is not None:
+        session.close()
+        thread_local.session = None
+        thread_local.vault_client = None
+
 
 def traverse_namespace(namespace_path: str, path_queue: str):
     """
@@ -57,11 +133,10 @@ def traverse_namespace(namespace_path: str, path_queue: str):
             key_path = namespace_path
 
         current_thread = threading.current_thread()
-        logging.info(f"{current_thread.name} processing namespace ({global_counter}): {key_path}")
+        logging.info("%s processing namespace (%d): %s", current_thread.name, global_counter, key_path)
 
         # Connect to vault and retrieve namespaces
-        vault_client = hvac.Client(url=VAULT_ADDR, token=VAULT_TOKEN, namespace=namespace_path, verify=VAULT_TLS_VERIFY,
-                                   timeout=HVAC_TIMEOUT, )
+        vault_client = get_vault_client(namespace_path)
 
         # Fetch auth methods and secrets engines
         global_auth_methods[key_path] = vault_client.sys.list_auth_methods()
@@ -80,31 +155,44 @@ def traverse_namespace(namespace_path: str, path_queue: str):
         pass
     # except hvac.exceptions.VaultError as e:
     except Exception as e:
-        logging.exception(f"Error traversing path {namespace_path}: {e}")
+        logging.exception("Error traversing path %s: %s", namespace_path, e)
         with global_thread_lock:
             global_error_counter += 1
 
 
-def write_to_file(cluster_name: str):
-    auth_json_filename = f'{cluster_name}-auth-methods-{datetime.now().strftime("%Y%m%d")}.json'
-    namespace_json_filename = f'{cluster_name}-namespaces-{datetime.now().strftime("%Y%m%d")}.json'
-    secret_json_filename = f'{cluster_name}-secrets-engines-{datetime.now().strftime("%Y%m%d")}.json'
-    logging.info(f"Writing output to files: {namespace_json_filename}, {auth_json_filename}, {secret_json_filename}")
+def write_json_file(filename: str, data: dict):
+    """
+    Writes data to a JSON file indented with 2 spaces, using orjson when it is installed.
+    Args:
+    filename: Name of the JSON file to write.
+    data: Data to serialize.
+    """
+    if orjson:
+        with open(filename, 'wb') as jsonfile:
+            jsonfile.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(filename, 'w') as jsonfile:
+            json.dump(data, jsonfile, indent=2)
 
-    with open(namespace_json_filename, 'w') as jsonfile:
-        json.dump(global_namespaces, jsonfile, indent=2)
 
-    with open(auth_json_filename, 'w') as jsonfile:
-        json.dump(global_auth_methods, jsonfile, indent=2)
+def write_to_file(cluster_name: str, date_str: str):
+    auth_json_filename = f'{cluster_name}-auth-methods-{date_str}.json'
+    namespace_json_filename = f'{cluster_name}-namespaces-{date_str}.json'
+    secret_json_filename = f'{cluster_name}-secrets-engines-{date_str}.json'
+    logging.info(f"Writing output to files: {namespace_json_filename}, {auth_json_filename}, {secret_json_filename}")
 
-    with open(secret_json_filename, 'w') as jsonfile:
-        json.dump(global_secret_engines, jsonfile, indent=2)
+    write_json_file(namespace_json_filename, global_namespaces)
+    write_json_file(auth_json_filename, global_auth_methods)
+    write_json_file(secret_json_filename, global_secret_engines)
 
 
-def summary_report(cluster_name: str):
-    auth_csv_filename = f"{cluster_name}-summary-auth-methods-{datetime.now().strftime('%Y%m%d')}.csv"
-    namespace_csv_filename = f"{cluster_name}-summary-namespaces-{datetime.now().strftime('%Y%m%d')}.csv"
-    secret_csv_filename = f"{cluster_name}-summary-secrets-engines-{datetime.now().strftime('%Y%m%d')}.csv"
+def summary_report(cluster_name: str, date_str: str):
+    # summary imports pandas, so it is only loaded once the traversal has finished
+    import summary
+
+    auth_csv_filename = f"{cluster_name}-summary-auth-methods-{date_str}.csv"
+    namespace_csv_filename = f"{cluster_name}-summary-namespaces-{date_str}.csv"
+    secret_csv_filename = f"{cluster_name}-summary-secrets-engines-{date_str}.csv"
 
     logging.info(f"Writing summary to files: {namespace_csv_filename}, {auth_csv_filename}, {secret_csv_filename}")
     summary.parse_namespaces(global_namespaces, namespace_csv_filename)
@@ -121,16 +209,17 @@ def worker(path_queue: str):
     while True:
         namespace_path = path_queue.get()
         if namespace_path is None:
+            close_session()
             break
 
         # Rate limit requests
         with global_thread_lock:
             global_counter += 1
-            logging.debug(f"global_counter: {global_counter}, namespace_path: {namespace_path}")
+            logging.debug("global_counter: %d, namespace_path: %s", global_counter, namespace_path)
 
             if not RATE_LIMIT_DISABLE and global_counter % RATE_LIMIT_BATCH_SIZE == 0:
-                logging.info(
-                    f"Rate limiting - sleep: {RATE_LIMIT_SLEEP_SECONDS} seconds, batch size: {RATE_LIMIT_BATCH_SIZE}")
+                logging.info("Rate limiting - sleep: %d seconds, batch size: %d",
+                             RATE_LIMIT_SLEEP_SECONDS, RATE_LIMIT_BATCH_SIZE)
                 time.sleep(RATE_LIMIT_SLEEP_SECONDS)
 
         try:
@@ -144,6 +233,9 @@ def main():
     Main function that initializes Vault client, creates threads, and starts traversal.
     """
 
+    # Date used in all output filenames, fixed at the start of the audit
+    date_str = datetime.now().strftime("%Y%m%d")
+
     try:
         # Check vault connection and exit if not authenticated
         vault_client = hvac.Client(url=VAULT_ADDR, token=VAULT_TOKEN, verify=VAULT_TLS_VERIFY, timeout=HVAC_TIMEOUT)
@@ -200,8 +292,8 @@ def main():
     # logging.debug(json.dumps(global_auth_methods, indent=2))
     # logging.debug(json.dumps(global_secret_engines, indent=2))
 
-    write_to_file(cluster_name)
-    summary_report(cluster_name)
+    write_to_file(cluster_name, date_str)
+    summary_report(cluster_name, date_str)
 
     logging.info(f"Namespace traversal complete: {global_counter} paths processed, {global_error_counter} errors")
 
@@ -230,24 +322,8 @@ if __name__ == "__main__":
         # Add trailing slash to namespace
         if not NAMESPACE_PATH.endswith("/"):
             NAMESPACE_PATH += "/"
-    else:
-        NAMESPACE_PATH = ""
 
     if args.workers:
         WORKER_THREADS = args.workers
 
-    # dictionaries to store outputs
-    global_namespaces = {}
-    global_auth_methods = {}
-    global_secret_engines = {}
-
-    # counter to rate limit requests
-    global_counter = 0
-
-    # counter to log errors
-    global_error_counter = 0
-
-    # thread lock for updating counters
-    global_thread_lock = threading.Lock()
-
     main()
@@ -17,7 +17,7 @@ def parse_namespaces(data: dict, csv_filename: str):
 
     logging.info("Parsing namespaces")
     df = pd.DataFrame.from_dict(data, orient='index', columns=['path', 'id', 'custom_metadata'])
-    df.insert(1, 'level_1_namespace', df['path'].apply(lambda x: x.split('/')[0] + '/'))
+    df.insert(1, 'level_1_namespace', df['path'].str.split('/', n=1).str[0] + '/')
     df.to_csv(csv_filename, index=False)
     logging.debug(df.head(3))
 
@@ -56,9 +56,8 @@ def parse_auth_methods(data: dict, csv_filename: str):
         result[key] = items
 
     df = pd.DataFrame.from_dict(result, orient='index')
-    for column in df.columns[2:]:
-        df[column] = df[column].fillna(0)
-        df[column] = df[column].astype(int)
+    count_columns = df.columns[2:]
+    df[count_columns] = df[count_columns].fillna(0).astype(int)
     df.to_csv(csv_filename, index=False)
     logging.debug(df.head(3))
 
@@ -93,10 +92,8 @@ def parse_secret_engines(data: dict, csv_filename: str):
         result[key] = items
 
     df = pd.DataFrame.from_dict(result, orient='index')
-
-    for column in df.columns[2:]:
-        df[column] = df[column].fillna(0)
-        df[column] = df[column].astype(int)
+    count_columns = df.columns[2:]
+    df[count_columns] = df[count_columns].fillna(0).astype(int)
     df.to_csv(csv_filename, index=False)
     logging.debug(df.head(3))
 